@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-15 09:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """
+    Refuse to continue while two accounts share an email that differs only
+    by case: the admin form and update_profile() never lowercased emails, so
+    such rows can exist and would make the unique constraint below fail with
+    an opaque IntegrityError. Resolve them by hand (rename or merge the
+    extra accounts), then re-run migrate.
+    """
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    duplicates = list(
+        CustomUser.objects
+        .values(email_ci=Lower('email'))
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .values_list('email_ci', flat=True)
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Cannot add uniq_user_email_ci: these emails are used by more '
+            'than one account (ignoring case): %s. Change or remove the extra '
+            'accounts, then run migrate again.' % ', '.join(sorted(duplicates))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_profile_picture'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='ix_user_username_lower'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='uniq_user_email_ci'),
+        ),
+    ]
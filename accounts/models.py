@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 class CustomUserManager(BaseUserManager):
@@ -42,5 +43,16 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    class Meta:
+        # Functional indexes so case-insensitive lookups (Lower(...) = value)
+        # are index probes instead of table scans. The unique constraint on
+        # Lower('email') doubles as the email lookup index.
+        indexes = [
+            models.Index(Lower('username'), name='ix_user_username_lower'),
+        ]
+        constraints = [
+            models.UniqueConstraint(Lower('email'), name='uniq_user_email_ci'),
+        ]
+
     def __str__(self):
         return self.email
@@ -1,3 +1,44 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import CustomUser
+
+
+class UpdateProfileConflictTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='alice@example.com', username='alice', password='pw',
+        )
+        CustomUser.objects.create_user(
+            email='bob@example.com', username='Bob', password='pw',
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('update_profile')
+
+    def test_username_conflict_is_case_insensitive(self):
+        response = self.client.post(self.url, {'username': 'bob'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'username': 'Username already taken.'})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.username, 'alice')
+
+    def test_email_conflict_is_case_insensitive(self):
+        response = self.client.post(self.url, {'email': 'BOB@example.com'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'email': 'Email already in use.'})
+
+    def test_both_conflicts_are_reported_together(self):
+        response = self.client.post(self.url, {'username': 'BOB', 'email': 'bob@EXAMPLE.com'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'username', 'email'})
+
+    def test_case_only_change_to_own_email_is_allowed(self):
+        response = self.client.post(self.url, {'email': 'Alice@Example.com'})
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'Alice@Example.com')
@@ -1,9 +1,13 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.http import JsonResponse
+from chat.presence import forget_presence
 from .forms import UserRegistrationForm, UserLoginForm
+from .models import CustomUser
 
 
 def register_view(request):
@@ -31,6 +35,7 @@ def login_view(request):
             user.is_online = True
             user.last_seen = timezone.now()
             user.save(update_fields=['is_online', 'last_seen'])
+            forget_presence(user.pk)
             login(request, user)
             return redirect('chat:user_list')
     else:
@@ -44,6 +49,7 @@ def logout_view(request):
         request.user.is_online = False
         request.user.last_seen = timezone.now()
         request.user.save(update_fields=['is_online', 'last_seen'])
+        forget_presence(request.user.pk)
     logout(request)
     return redirect('login')
 
@@ -60,16 +66,37 @@ def update_profile(request):
     new_username = request.POST.get('username', '').strip()
     new_email    = request.POST.get('email', '').strip()
 
-    if new_username and new_username != user.username:
-        from .models import CustomUser
-        if CustomUser.objects.filter(username=new_username).exclude(pk=user.pk).exists():
+    change_username = bool(new_username) and new_username != user.username
+    change_email    = bool(new_email) and new_email != user.email
+
+    # One round-trip for both uniqueness checks: fetch any other user whose
+    # username OR email collides (case-insensitively), then sort out which.
+    conflicts = Q()
+    if change_username:
+        conflicts |= Q(username_lower=new_username.lower())
+    if change_email:
+        conflicts |= Q(email_lower=new_email.lower())
+
+    taken_usernames, taken_emails = set(), set()
+    if conflicts:
+        for username, email in (
+            CustomUser.objects
+            .alias(username_lower=Lower('username'), email_lower=Lower('email'))
+            .filter(conflicts)
+            .exclude(pk=user.pk)
+            .values_list('username', 'email')
+        ):
+            taken_usernames.add(username.lower())
+            taken_emails.add(email.lower())
+
+    if change_username:
+        if new_username.lower() in taken_usernames:
             errors['username'] = 'Username already taken.'
         else:
             user.username = new_username
 
-    if new_email and new_email != user.email:
-        from .models import CustomUser
-        if CustomUser.objects.filter(email=new_email).exclude(pk=user.pk).exists():
+    if change_email:
+        if new_email.lower() in taken_emails:
             errors['email'] = 'Email already in use.'
         else:
             user.email = new_email
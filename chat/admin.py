@@ -1,3 +1,20 @@
 from django.contrib import admin
+from .models import Message
 
-# Register your models here.
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'sender', 'receiver', 'message', 'timestamp', 'is_read', 'deleted_at')
+    list_filter = ('is_read', 'timestamp', 'deleted_at')
+    search_fields = ('message', 'sender__email', 'receiver__email')
+    raw_id_fields = ('room', 'sender', 'receiver')
+    ordering = ('-timestamp',)
+
+    # Join both users into the changelist query instead of one SELECT per row
+    list_select_related = ('sender', 'receiver')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).only(
+            'id', 'message', 'timestamp', 'is_read', 'deleted_at',
+            'sender__email', 'receiver__email',
+        )
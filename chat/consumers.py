@@ -16,32 +16,52 @@ Security layers applied
 6. Input validation : Every incoming payload is validated for type,
                       presence of required keys, and safe value ranges
                       before acting on it.
-7. Message length   : Messages are capped at MAX_MESSAGE_LENGTH chars
-                      to guard against DoS.
+7. Message length   : Raw frames over MAX_FRAME_LENGTH close the socket
+                      before any JSON parsing; messages are capped at
+                      MAX_MESSAGE_LENGTH chars to guard against DoS.
 8. Read-ID limit    : read_receipt payloads are capped at MAX_READ_IDS
                       entries to prevent abuse.
 9. DB ownership     : mark_messages_read() filters by receiver=self.user
                       so a user can never mark another user's messages read.
 10. Delete auth     : delete_message_db() verifies sender=self.user before
-                      deleting — the DB layer enforces ownership even if
-                      the WS payload is crafted.
+                      soft-deleting — the DB layer enforces ownership even
+                      if the WS payload is crafted.
 """
 
-import json
 import logging
 
-from channels.generic.websocket import AsyncWebsocketConsumer
+import orjson
+
 from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from .models import Message
+from . import message_writer, presence
+from .models import ChatRoom, Message
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
 # ── Tunable limits ────────────────────────────────────────────────────────────
 MAX_MESSAGE_LENGTH = 4_000   # characters
+MAX_FRAME_LENGTH   = 16_384  # characters per raw WS text frame
 MAX_READ_IDS       = 500     # IDs per receipt payload
+MAX_MESSAGE_ID     = 2**63 - 1  # BigAutoField upper bound (and orjson's int range)
+
+
+def _user_exists(user_id):
+    return User.objects.filter(id=user_id).exists()
+
+
+# Read-only and independent of any other query, so it may run on any thread
+# in the pool rather than queueing on the single thread-sensitive executor
+# that serialises the other DB helpers (one slow query would block every
+# handshake).
+_user_exists_async = database_sync_to_async(_user_exists, thread_sensitive=False)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -80,28 +100,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close(code=4003)
             return
 
-        # ── 4. Verify the target user exists ─────────────────────────────────
-        if not await self.check_user_exists(other_user_id):
-            logger.warning('WS rejected: target user %s does not exist', other_user_id)
-            await self.close(code=4004)
-            return
+        # ── 4. Resolve the room (proves the target user exists) ───────────────
+        #   Messages are stored against a persisted ChatRoom row. Its ID is
+        #   cached in the shared cache: a hit means both users existed when
+        #   the room was made (the entry is dropped when the room is deleted,
+        #   which user deletion cascades to), so reconnects skip the DB.
+        lo, hi = ChatRoom.ordered(self.user.id, other_user_id)
+        room_id = await cache.aget(ChatRoom.cache_key(lo, hi))
+        if room_id is None:
+            #   On a miss the room lookup hits the DB anyway, so the target is
+            #   checked with a fresh PK probe rather than an in-process cache
+            #   that another worker's deletion could leave stale. A user
+            #   deleted in between fails the room INSERT's FK check instead.
+            if await self.check_user_exists(other_user_id):
+                try:
+                    room_id = await self.get_room_id(lo, hi)
+                except IntegrityError:
+                    pass
+            if room_id is None:
+                logger.warning('WS rejected: target user %s does not exist', other_user_id)
+                await self.close(code=4004)
+                return
+            await cache.aset(ChatRoom.cache_key(lo, hi), room_id, ChatRoom.CACHE_TTL)
 
         # ── 5. Build room name & confirm participant membership ───────────────
         #   The room is named chat_<lower_id>_<higher_id>.
         #   Only the two users whose IDs appear in that name may join it.
+        #   The connecting user's own ID is always one half of the pair, so
+        #   membership holds by construction.
         self.other_user_id = other_user_id
-        user_ids = sorted([self.user.id, other_user_id])
-        self.room_group_name = f'chat_{user_ids[0]}_{user_ids[1]}'
-
-        # Double-check: the connecting user's ID must be in the pair.
-        # (Redundant given the flow above, but explicit for defence-in-depth.)
-        if self.user.id not in user_ids:
-            logger.error(
-                'WS rejected: user %s is not a participant of room %s',
-                self.user.id, self.room_group_name
-            )
-            await self.close(code=4005)
-            return
+        self.room_id = room_id
+        self.room_group_name = f'chat_{lo}_{hi}'
 
         # ── All checks passed — join the group ────────────────────────────────
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
@@ -128,11 +157,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # Receive (client → server)
     # ──────────────────────────────────────────────────────────────────────────
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        # ── Reject oversized / binary frames before parsing ───────────────────
+        if text_data is None or len(text_data) > MAX_FRAME_LENGTH:
+            logger.warning(
+                'WS rejected frame from %s: %s',
+                self.user.username,
+                'binary' if text_data is None else f'{len(text_data)} chars',
+            )
+            await self.close(code=4009)
+            return
+
         # ── Validate JSON ─────────────────────────────────────────────────────
         try:
-            payload = json.loads(text_data)
-        except (json.JSONDecodeError, ValueError):
+            payload = orjson.loads(text_data)
+        except orjson.JSONDecodeError:
             logger.warning('WS bad payload from %s: not valid JSON', self.user.username)
             return
 
@@ -161,28 +200,47 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Validate and persist a chat message then broadcast it."""
         message_text = payload.get('message', '')
 
-        # Type and presence check
-        if not isinstance(message_text, str) or not message_text.strip():
+        # Type and presence check (strip once; reused below)
+        if not isinstance(message_text, str):
+            return
+        message_text = message_text.strip()
+        if not message_text:
             return
 
-        # Length cap
+        # Length cap — applied after stripping so surrounding whitespace
+        # never counts towards the limit
         if len(message_text) > MAX_MESSAGE_LENGTH:
             logger.warning(
                 'WS message from %s truncated (%d chars)',
                 self.user.username, len(message_text)
             )
-            message_text = message_text[:MAX_MESSAGE_LENGTH]
+            message_text = message_text[:MAX_MESSAGE_LENGTH].rstrip()
 
-        message_id = await self.save_message(message_text.strip())
+        try:
+            message_id = await self.save_message(message_text)
+        except DatabaseError as exc:
+            # Drop this message but keep the socket (and the room) usable
+            logger.warning('WS message from %s not saved: %s', self.user.username, exc)
+            return
 
+        text = orjson.dumps({
+            'type': 'chat_message',
+            'message': message_text,
+            'sender': self.user.username,
+            'sender_id': self.user.id,
+            'message_id': message_id,
+        }).decode()
+
+        # Confirm to the sender's own socket directly; the group copy is
+        # skipped for this channel so it is not delivered twice. Other
+        # sockets of the sender (extra tabs) still get it via the group.
+        await self.send(text_data=text)
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': message_text.strip(),
-                'sender': self.user.username,
-                'sender_id': self.user.id,
-                'message_id': message_id,
+                'text': text,
+                'origin': self.channel_name,
             }
         )
 
@@ -201,27 +259,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Cap to prevent abuse
         raw_ids = raw_ids[:MAX_READ_IDS]
 
-        # Coerce to ints, silently drop anything that isn't
-        read_ids = []
-        for rid in raw_ids:
-            try:
-                read_ids.append(int(rid))
-            except (TypeError, ValueError):
-                pass
+        # Keep ints and digit-only strings (at most 19 digits, so int() can
+        # never overflow the BigAutoField range check), de-duplicated.
+        # Anything else is silently dropped.
+        candidates = (
+            int(rid) for rid in raw_ids
+            if type(rid) is int
+            or (isinstance(rid, str) and rid.isdecimal() and len(rid) < 20)
+        )
+        read_ids = {rid for rid in candidates if 0 < rid <= MAX_MESSAGE_ID}
 
         if not read_ids:
             return
 
         await self.mark_messages_read(read_ids)
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'messages_read',
-                'read_ids': read_ids,
-                'reader_id': self.user.id,
-            }
-        )
+        await self._broadcast({
+            'type': 'messages_read',
+            'read_ids': sorted(read_ids),
+            'reader_id': self.user.id,
+        })
 
     async def _handle_delete_message(self, payload):
         """
@@ -242,14 +299,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         if deleted:
             # Broadcast removal to both participants in the room
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'message_deleted',
-                    'message_id': message_id,
-                    'deleted_by': self.user.id,
-                }
-            )
+            await self._broadcast({
+                'type': 'message_deleted',
+                'message_id': message_id,
+                'deleted_by': self.user.id,
+            })
         else:
             # Silently log — someone tried to delete a msg they don't own
             logger.warning(
@@ -259,22 +313,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def _handle_typing(self):
         """Broadcast a typing signal to the other participant."""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_typing',
-                'sender_id': self.user.id,
-            }
-        )
+        await self._broadcast({
+            'type': 'user_typing',
+            'sender_id': self.user.id,
+        })
 
     async def _handle_stop_typing(self):
         """Broadcast a stop-typing signal to the other participant."""
+        await self._broadcast({
+            'type': 'user_stop_typing',
+            'sender_id': self.user.id,
+        })
+
+    async def _broadcast(self, frame):
+        """
+        Serialise a client frame once and fan it out to the room.
+        The group event is named after the frame's 'type' and carries the
+        encoded text, so each recipient's handler forwards it as-is instead
+        of re-encoding it (same scheme as chat messages).
+        """
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'user_stop_typing',
-                'sender_id': self.user.id,
-            }
+            {'type': frame['type'], 'text': orjson.dumps(frame).decode()},
         )
 
     # ──────────────────────────────────────────────────────────────────────────
@@ -282,102 +342,91 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # ──────────────────────────────────────────────────────────────────────────
 
     async def chat_message(self, event):
-        """Deliver a chat message to the connected client."""
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'sender': event['sender'],
-            'sender_id': event['sender_id'],
-            'message_id': event['message_id'],
-        }))
+        """Deliver a chat message (pre-serialised by the sender) to the client."""
+        if event.get('origin') == self.channel_name:
+            return   # already echoed locally in _handle_chat_message()
+        await self.send(text_data=event['text'])
 
     async def messages_read(self, event):
         """Notify the sender that specific messages were read."""
-        await self.send(text_data=json.dumps({
-            'type': 'messages_read',
-            'read_ids': event['read_ids'],
-            'reader_id': event['reader_id'],
-        }))
+        await self.send(text_data=event['text'])
 
     async def message_deleted(self, event):
         """Tell both participants to remove the deleted message bubble."""
-        await self.send(text_data=json.dumps({
-            'type': 'message_deleted',
-            'message_id': event['message_id'],
-            'deleted_by': event['deleted_by'],
-        }))
+        await self.send(text_data=event['text'])
 
     async def user_typing(self, event):
         """Forward a typing signal to the connected client."""
-        await self.send(text_data=json.dumps({
-            'type': 'user_typing',
-            'sender_id': event['sender_id'],
-        }))
+        await self.send(text_data=event['text'])
 
     async def user_stop_typing(self, event):
         """Forward a stop-typing signal to the connected client."""
-        await self.send(text_data=json.dumps({
-            'type': 'user_stop_typing',
-            'sender_id': event['sender_id'],
-        }))
+        await self.send(text_data=event['text'])
 
     # ──────────────────────────────────────────────────────────────────────────
     # Database helpers  (run in a thread pool via database_sync_to_async)
     # ──────────────────────────────────────────────────────────────────────────
 
-    @database_sync_to_async
-    def check_user_exists(self, user_id):
-        return User.objects.filter(id=user_id).exists()
+    async def check_user_exists(self, user_id):
+        """PK existence probe; only reached when the room ID is not cached."""
+        return await _user_exists_async(user_id)
+
+    async def save_message(self, message):
+        """
+        Persist a message and return its PK.
+        FKs are set by ID — the receiver was validated in connect(), so there
+        is no need to SELECT the user row again on every message. The INSERT
+        is batched with concurrent sends from other consumers (message_writer).
+        """
+        return await message_writer.save_message(
+            self.room_id, self.user.id, self.other_user_id, message,
+        )
 
     @database_sync_to_async
-    def save_message(self, message):
-        """Persist a message and return its PK."""
-        other_user = User.objects.get(id=self.other_user_id)
-        msg = Message.objects.create(
-            sender=self.user,
-            receiver=other_user,
-            message=message,
+    def get_room_id(self, user_a_id, user_b_id):
+        """Fetch (or create on first contact) the room for an ordered pair."""
+        room, _ = ChatRoom.objects.get_or_create(
+            user_a_id=user_a_id, user_b_id=user_b_id,
         )
-        return msg.id
+        return room.id
 
     @database_sync_to_async
     def mark_messages_read(self, message_ids):
         """
         Mark messages as read.
-        The receiver=self.user filter ensures a user can ONLY mark messages
+        The receiver_id=self.user.id filter ensures a user can ONLY mark messages
         that were addressed to them — never someone else's conversation.
         """
         Message.objects.filter(
             id__in=message_ids,
-            receiver=self.user,
+            receiver_id=self.user.id,
             is_read=False,
+            deleted_at__isnull=True,
         ).update(is_read=True)
 
     @database_sync_to_async
     def delete_message_db(self, message_id):
         """
-        Delete a message only if the current user is the sender.
+        Soft-delete a message only if the current user is the sender.
         Returns True on success, False if the message was not found
         or the user does not own it.
+
+        A single UPDATE — no cascade collection or delete signals. Coalesce
+        keeps the original deleted_at when the message was already removed
+        through the HTTP endpoint, so the broadcast still goes out.
         """
-        deleted_count, _ = Message.objects.filter(
+        updated = Message.objects.filter(
             id=message_id,
-            sender=self.user,   # ← ownership enforced at DB level
-        ).delete()
-        return deleted_count > 0
+            sender_id=self.user.id,   # ← ownership enforced at DB level
+        ).update(deleted_at=Coalesce('deleted_at', timezone.now()))
+        return updated > 0
 
-    @database_sync_to_async
-    def set_user_online(self, user):
-        from django.utils import timezone
-        User.objects.filter(pk=user.pk).update(
-            is_online=True,
-            last_seen=timezone.now(),
-        )
+    # ──────────────────────────────────────────────────────────────────────────
+    # Presence helpers  (cache-backed; flushed to the DB in bulk)
+    # ──────────────────────────────────────────────────────────────────────────
 
-    @database_sync_to_async
-    def set_user_offline(self, user):
-        from django.utils import timezone
-        User.objects.filter(pk=user.pk).update(
-            is_online=False,
-            last_seen=timezone.now(),
-        )
\ No newline at end of file
+    async def set_user_online(self, user):
+        await presence.set_presence(user.pk, True)
+
+    async def set_user_offline(self, user):
+        await presence.set_presence(user.pk, False)
@@ -0,0 +1,104 @@
+"""
+message_writer.py – Coalesces chat-message INSERTs across consumers.
+
+Every consumer in the process hands new messages to a single writer task,
+which drains whatever has queued up (at most MAX_BATCH_SIZE rows) and saves
+it with one bulk_create. An idle writer flushes straight away, so a lone
+message pays no extra latency; under load, N concurrent sends cost one DB
+round-trip instead of N.
+"""
+
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.db import DatabaseError, transaction
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# ── Tunable limits ────────────────────────────────────────────────────────────
+MAX_BATCH_SIZE = 50   # rows per bulk_create
+
+_queue = None
+_writer_task = None
+
+
+def _insert(messages):
+    """
+    INSERT `messages` and return, per row, its new PK or the exception that
+    stopped it being saved.
+
+    The batch goes in with one bulk_create. If that fails (e.g. a receiver
+    was deleted while the peer's socket was still open) the rows are retried
+    one by one, each in its own transaction, so a single bad row only fails
+    its own sender instead of every message in the batch.
+    """
+    try:
+        Message.objects.bulk_create(messages)
+        return [msg.id for msg in messages]
+    except DatabaseError:
+        if len(messages) == 1:
+            raise
+        logger.warning('Bulk insert of %d messages failed; retrying row by row', len(messages))
+
+    results = []
+    for msg in messages:
+        try:
+            with transaction.atomic():
+                msg.save(force_insert=True)
+            results.append(msg.id)
+        except DatabaseError as exc:
+            results.append(exc)
+    return results
+
+
+# Wrapped like the consumer's DB helpers so each batch runs behind Channels'
+# close_old_connections(), which recycles broken / expired connections.
+_insert_async = database_sync_to_async(_insert)
+
+
+async def save_message(room_id, sender_id, receiver_id, text):
+    """Queue a message for insertion and return its PK once it is written."""
+    _ensure_writer()
+    future = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((
+        Message(
+            room_id=room_id,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            message=text,
+        ),
+        future,
+    ))
+    return await future
+
+
+def _ensure_writer():
+    """Start the per-process writer task the first time a message is sent."""
+    global _queue, _writer_task
+    if _writer_task is None or _writer_task.done():
+        _queue = asyncio.Queue()
+        _writer_task = asyncio.get_running_loop().create_task(_writer_loop(_queue))
+
+
+async def _writer_loop(queue):
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < MAX_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+
+        try:
+            results = await _insert_async([msg for msg, _ in batch])
+        except Exception as exc:
+            logger.exception('Saving a batch of %d messages failed', len(batch))
+            results = [exc] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-15 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_ix_msg_unread'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
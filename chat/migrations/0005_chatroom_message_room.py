@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-15 12:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_rooms(apps, schema_editor):
+    """
+    Create a ChatRoom for every existing conversation and link its messages.
+
+    Self-addressed rows cannot belong to any room (chatroom_pair_ordered
+    forbids it) and were never reachable from the UI, so they are removed
+    before 0006 makes Message.room NOT NULL.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+
+    pairs = Message.objects.values_list('sender_id', 'receiver_id').distinct()
+    for sender_id, receiver_id in pairs:
+        if sender_id == receiver_id:
+            continue
+        lo, hi = (sender_id, receiver_id) if sender_id < receiver_id else (receiver_id, sender_id)
+        room, _ = ChatRoom.objects.get_or_create(user_a_id=lo, user_b_id=hi)
+        Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id).update(room=room)
+
+    Message.objects.filter(room__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_msg_rx_sx_unread_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatRoom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_a', 'user_b'), name='uniq_chatroom_pair'), models.CheckConstraint(condition=models.Q(('user_a__lt', models.F('user_b'))), name='chatroom_pair_ordered')],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='room',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.chatroom'),
+        ),
+        migrations.RunPython(backfill_rooms, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='msg_room_id_idx'),
+        ),
+    ]
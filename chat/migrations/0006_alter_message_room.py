@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-15 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Separate from 0005 so the backfill's UPDATEs are committed before the
+    # table is altered (PostgreSQL refuses ALTER TABLE with pending
+    # deferred-FK trigger events in the same transaction).
+
+    dependencies = [
+        ('chat', '0005_chatroom_message_room'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='room',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.chatroom'),
+        ),
+    ]
@@ -1,15 +1,76 @@
 from django.db import models
 from django.conf import settings
 
+# Cache key of the contacts list shared by every viewer (chat.views); the
+# user post_save / post_delete receivers in signals.py drop it.
+SIDEBAR_CACHE_KEY = 'chat:sidebar_users'
+
+
+class ChatRoom(models.Model):
+    """
+    One row per pair of users who have chatted. user_a always holds the
+    lower user ID, so a pair maps to exactly one room.
+    """
+    user_a = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+    CACHE_TTL = 300   # seconds a resolved room ID stays in the cache
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='uniq_chatroom_pair'),
+            models.CheckConstraint(condition=models.Q(user_a__lt=models.F('user_b')), name='chatroom_pair_ordered'),
+        ]
+
+    def __str__(self):
+        return f"Room {self.user_a_id}-{self.user_b_id}"
+
+    @staticmethod
+    def ordered(a, b):
+        """Return the (user_a_id, user_b_id) pair for two user IDs."""
+        return (a, b) if a < b else (b, a)
+
+    @staticmethod
+    def cache_key(user_a_id, user_b_id):
+        """Cache key holding the room ID of an ordered pair (see ordered())."""
+        return f'chat:room:{user_a_id}:{user_b_id}'
+
+
 class Message(models.Model):
+    # Indexed by msg_room_id_idx below, so the FK's own index is skipped
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages', db_index=False)
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
-    receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages')
+    # Leading column of msg_rx_sx_unread_idx below, so no separate FK index
+    receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages', db_index=False)
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Unread messages from one user to another (mark-read endpoint,
+            # chat page open).
+            models.Index(
+                fields=['receiver', 'sender', 'is_read'],
+                name='msg_rx_sx_unread_idx',
+            ),
+            # Conversation history: one range scan per room, already in
+            # -id order for the LIMITed page query.
+            models.Index(
+                fields=['room', 'id'],
+                name='msg_room_id_idx',
+            ),
+            # Partial index covering only unread rows: read receipts
+            # (id IN (...) AND receiver_id = ? AND is_read = false) touch
+            # just the rows that still need flipping.
+            models.Index(
+                fields=['receiver', 'id'],
+                condition=models.Q(is_read=False),
+                name='ix_msg_unread',
+            ),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender} to {self.receiver} at {self.timestamp}"
@@ -0,0 +1,139 @@
+"""
+presence.py – Cache-backed online / last-seen tracking.
+
+WebSocket connects and disconnects are frequent (mobile reconnects, flaky
+networks), so instead of issuing an UPDATE on the user row for every event
+the consumer records presence in the cache and the accumulated changes are
+written to the database by a background task in a single bulk_update every
+PRESENCE_FLUSH_INTERVAL seconds (and once more when the process exits).
+
+Views overlay the cached state on top of the DB columns so pages always show
+the freshest value, even between flushes.
+"""
+
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# ── Tunable limits ────────────────────────────────────────────────────────────
+PRESENCE_TTL            = 90   # seconds a cached presence entry stays valid
+PRESENCE_FLUSH_INTERVAL = 30   # seconds between DB flushes
+
+# IDs whose cached presence has not been written to the DB yet.
+# Only ever touched from the event loop thread.
+_dirty_ids = set()
+_flush_task = None
+
+
+def _key(user_id):
+    return f'presence:{user_id}'
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Writers (consumer side)
+# ──────────────────────────────────────────────────────────────────────────────
+
+async def set_presence(user_id, is_online):
+    """Record presence in the cache and queue it for the next DB flush."""
+    await cache.aset(
+        _key(user_id),
+        {'is_online': is_online, 'last_seen': timezone.now()},
+        PRESENCE_TTL,
+    )
+    _dirty_ids.add(user_id)
+    _ensure_flush_task()
+
+
+def _ensure_flush_task():
+    """Start the per-process flush loop the first time presence changes."""
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(PRESENCE_FLUSH_INTERVAL)
+        try:
+            await flush_presence()
+        except Exception:
+            logger.exception('Presence flush failed')
+
+
+def _write_presence(user_ids):
+    """bulk_update the cached presence of `user_ids`; returns rows written."""
+    states = cache.get_many([_key(uid) for uid in user_ids])
+    users = [
+        User(pk=uid, is_online=state['is_online'], last_seen=state['last_seen'])
+        for uid in user_ids
+        if (state := states.get(_key(uid))) is not None
+    ]
+    if users:
+        User.objects.bulk_update(users, ['is_online', 'last_seen'])
+    return len(users)
+
+
+async def flush_presence():
+    """
+    Write every pending presence change to the DB in one bulk_update.
+    Returns the number of users written. On failure the IDs stay pending
+    so the next flush retries them.
+    """
+    if not _dirty_ids:
+        return 0
+
+    user_ids = list(_dirty_ids)
+    _dirty_ids.clear()
+    try:
+        return await database_sync_to_async(_write_presence)(user_ids)
+    except Exception:
+        _dirty_ids.update(user_ids)
+        raise
+
+
+@atexit.register
+def _flush_on_exit():
+    """Write out changes still pending when the worker shuts down."""
+    if not _dirty_ids:
+        return
+    try:
+        _write_presence(list(_dirty_ids))
+    except Exception:
+        logger.exception('Presence flush on shutdown failed')
+    else:
+        _dirty_ids.clear()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Readers (view side)
+# ──────────────────────────────────────────────────────────────────────────────
+
+def apply_presence(users):
+    """
+    Overwrite is_online / last_seen on every User in `users` with the cached
+    value, when one exists. Falls back to the DB columns otherwise.
+    """
+    states = cache.get_many([_key(user.pk) for user in users])
+    for user in users:
+        state = states.get(_key(user.pk))
+        if state is not None:
+            user.is_online = state['is_online']
+            user.last_seen = state['last_seen']
+    return users
+
+
+def forget_presence(user_id):
+    """
+    Drop any cached presence for `user_id` so the DB columns written by the
+    login / logout views take effect immediately (and are not overwritten by
+    a stale pending flush).
+    """
+    cache.delete(_key(user_id))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SIDEBAR_CACHE_KEY, ChatRoom
+
+
+@receiver(post_delete, sender=ChatRoom)
+def evict_deleted_room(sender, instance, **kwargs):
+    """Drop the cached room ID so connect() re-validates the pair."""
+    cache.delete(ChatRoom.cache_key(instance.user_a_id, instance.user_b_id))
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_sidebar_cache(sender, **kwargs):
+    """Any user change (sign-up, profile edit, login) refreshes the contacts list."""
+    cache.delete(SIDEBAR_CACHE_KEY)
@@ -1,3 +1,470 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import message_writer, presence
+from .consumers import ChatConsumer
+from .models import SIDEBAR_CACHE_KEY, ChatRoom, Message
+from .routing import websocket_urlpatterns
+from .views import HISTORY_PAGE_SIZE
+
+User = get_user_model()
+
+
+def make_user(username):
+    return User.objects.create_user(
+        email=f'{username}@example.com', username=username, password='pw',
+    )
+
+
+def make_room(user, other):
+    user_a_id, user_b_id = ChatRoom.ordered(user.id, other.id)
+    return ChatRoom.objects.create(user_a_id=user_a_id, user_b_id=user_b_id)
+
+
+def chat_communicator(user, other_user_id):
+    communicator = WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns), f'/ws/chat/{other_user_id}/',
+    )
+    communicator.scope['user'] = user
+    return communicator
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Presence flush  (database_sync_to_async closes connections, so no TestCase)
+# ──────────────────────────────────────────────────────────────────────────────
+
+class PresenceFlushTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        presence._dirty_ids.clear()
+        presence._flush_task = None
+        self.user = make_user('alice')
+        User.objects.filter(pk=self.user.pk).update(is_online=False)
+
+    def tearDown(self):
+        presence._dirty_ids.clear()
+
+    async def test_flush_writes_cached_state_once(self):
+        await presence.set_presence(self.user.pk, True)
+
+        self.assertEqual(await presence.flush_presence(), 1)
+        self.assertEqual(presence._dirty_ids, set())
+        self.assertEqual(await presence.flush_presence(), 0)
+
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.is_online)
+
+    async def test_failed_flush_keeps_ids_pending(self):
+        await presence.set_presence(self.user.pk, True)
+
+        with mock.patch.object(
+            User.objects, 'bulk_update',
+            side_effect=OperationalError('database is locked'),
+        ):
+            with self.assertRaises(OperationalError):
+                await presence.flush_presence()
+        self.assertEqual(presence._dirty_ids, {self.user.pk})
+
+        self.assertEqual(await presence.flush_presence(), 1)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.is_online)
+
+    def test_flush_on_exit_writes_pending_ids(self):
+        cache.set(presence._key(self.user.pk), {'is_online': True, 'last_seen': timezone.now()})
+        presence._dirty_ids.add(self.user.pk)
+
+        presence._flush_on_exit()
+
+        self.assertEqual(presence._dirty_ids, set())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_online)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# History pagination
+# ──────────────────────────────────────────────────────────────────────────────
+
+class MessageHistoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        room = make_room(self.alice, self.bob)
+        self.ids = [
+            Message.objects.create(
+                room=room, sender=self.alice, receiver=self.bob, message=f'm{i}',
+            ).id
+            for i in range(HISTORY_PAGE_SIZE + 10)
+        ]
+        self.client.force_login(self.alice)
+        self.url = reverse('chat:message_history', args=[self.bob.id])
+
+    def test_returns_page_before_cursor_oldest_first(self):
+        cursor = self.ids[-1]
+        response = self.client.get(self.url, {'before': cursor})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        page_ids = [m['id'] for m in data['messages']]
+        self.assertEqual(page_ids, self.ids[-1 - HISTORY_PAGE_SIZE:-1])
+        self.assertTrue(data['has_more'])
+        self.assertTrue(all(m['mine'] for m in data['messages']))
+
+    def test_last_page_has_no_more(self):
+        response = self.client.get(self.url, {'before': self.ids[5]})
+
+        data = response.json()
+        self.assertEqual([m['id'] for m in data['messages']], self.ids[:5])
+        self.assertFalse(data['has_more'])
+
+    def test_soft_deleted_messages_are_skipped(self):
+        Message.objects.filter(id=self.ids[1]).update(deleted_at=timezone.now())
+
+        response = self.client.get(self.url, {'before': self.ids[3]})
+
+        self.assertEqual(
+            [m['id'] for m in response.json()['messages']],
+            [self.ids[0], self.ids[2]],
+        )
+
+    def test_bad_cursor_is_rejected(self):
+        for params in ({'before': 'abc'}, {}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Mark-read endpoint  (UPDATE ... RETURNING)
+# ──────────────────────────────────────────────────────────────────────────────
+
+class MarkMessagesReadTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+        bob_room = make_room(self.alice, self.bob)
+        carol_room = make_room(self.alice, self.carol)
+
+        def send(room, sender, receiver, **fields):
+            return Message.objects.create(
+                room=room, sender=sender, receiver=receiver, message='hi', **fields,
+            )
+
+        self.unread = [send(bob_room, self.bob, self.alice) for _ in range(2)]
+        self.already_read = send(bob_room, self.bob, self.alice, is_read=True)
+        self.deleted = send(bob_room, self.bob, self.alice, deleted_at=timezone.now())
+        self.from_carol = send(carol_room, self.carol, self.alice)
+        self.to_bob = send(bob_room, self.alice, self.bob)
+
+        self.client.force_login(self.alice)
+        self.url = reverse('chat:mark_messages_read', args=[self.bob.id])
+
+    def test_returns_only_rows_it_flipped(self):
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(response.json()['read_ids'], [m.id for m in self.unread])
+
+        unread = set(Message.objects.filter(is_read=False).values_list('id', flat=True))
+        self.assertEqual(unread, {self.deleted.id, self.from_carol.id, self.to_bob.id})
+
+    def test_second_call_returns_nothing(self):
+        self.client.post(self.url)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.json()['read_ids'], [])
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class SidebarCacheInvalidationTests(TestCase):
+
+    def test_user_save_and_delete_drop_the_cached_list(self):
+        user = make_user('alice')
+
+        for change in (user.save, user.delete):
+            cache.set(SIDEBAR_CACHE_KEY, ['stale'])
+            change()
+            self.assertIsNone(cache.get(SIDEBAR_CACHE_KEY))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Batched message writer
+# ──────────────────────────────────────────────────────────────────────────────
+
+class MessageWriterTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        message_writer._writer_task = None
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+
+    async def _save_concurrently(self, *receiver_ids):
+        with mock.patch.object(
+            Message.objects, 'bulk_create', wraps=Message.objects.bulk_create,
+        ) as bulk_create:
+            results = await asyncio.gather(
+                *(
+                    message_writer.save_message(
+                        self.room.id, self.alice.id, receiver_id, f'm{i}',
+                    )
+                    for i, receiver_id in enumerate(receiver_ids)
+                ),
+                return_exceptions=True,
+            )
+        return results, bulk_create
+
+    async def test_concurrent_sends_share_one_insert(self):
+        results, bulk_create = await self._save_concurrently(*[self.bob.id] * 3)
+
+        bulk_create.assert_called_once()
+        self.assertEqual(len(bulk_create.call_args.args[0]), 3)
+        saved = [m async for m in Message.objects.order_by('id').values_list('id', flat=True)]
+        self.assertEqual(results, saved)
+
+    async def test_bad_row_fails_only_its_own_sender(self):
+        results, _ = await self._save_concurrently(self.bob.id, 999_999, self.bob.id)
+
+        self.assertIsInstance(results[1], IntegrityError)
+        saved = [m async for m in Message.objects.order_by('id').values_list('id', flat=True)]
+        self.assertEqual([results[0], results[2]], saved)
+
+
+class ChatConsumerSaveFailureTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        message_writer._writer_task = None
+        presence._flush_task = None
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+
+    def tearDown(self):
+        presence._dirty_ids.clear()
+
+    async def test_socket_survives_a_failed_save(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/{self.bob.id}/',
+        )
+        communicator.scope['user'] = self.alice
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        # The peer disappears while this socket is still open
+        await database_sync_to_async(self.bob.delete)()
+
+        await communicator.send_json_to({'message': 'hello?'})
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({'type': 'typing'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'user_typing')
+
+        await communicator.disconnect()
+        self.assertFalse(await Message.objects.aexists())
+
+
+class DeleteMessageViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.message = Message.objects.create(
+            room=make_room(self.alice, self.bob),
+            sender=self.alice, receiver=self.bob, message='oops',
+        )
+        self.url = reverse('chat:delete_message', args=[self.message.id])
+
+    def test_sender_soft_deletes(self):
+        self.client.force_login(self.alice)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.json(), {'deleted': True, 'message_id': self.message.id})
+        self.message.refresh_from_db()
+        self.assertIsNotNone(self.message.deleted_at)
+
+    def test_other_user_gets_403(self):
+        self.client.force_login(self.bob)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 403)
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.deleted_at)
+
+    def test_already_deleted_message_is_404(self):
+        Message.objects.filter(pk=self.message.pk).update(deleted_at=timezone.now())
+        self.client.force_login(self.alice)
+
+        self.assertEqual(self.client.post(self.url).status_code, 404)
+
+
+class ChatConsumerDeleteTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        presence._flush_task = None
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+
+    def tearDown(self):
+        presence._dirty_ids.clear()
+
+    async def test_delete_after_http_delete_keeps_timestamp_and_broadcasts(self):
+        deleted_at = timezone.now() - timedelta(minutes=5)
+        message = await Message.objects.acreate(
+            room=self.room, sender=self.alice, receiver=self.bob,
+            message='oops', deleted_at=deleted_at,
+        )
+        communicator = chat_communicator(self.alice, self.bob.id)
+        await communicator.connect()
+
+        await communicator.send_json_to({'type': 'delete_message', 'message_id': message.id})
+        frame = await communicator.receive_json_from()
+
+        self.assertEqual(frame['type'], 'message_deleted')
+        self.assertEqual(frame['message_id'], message.id)
+        await message.arefresh_from_db()
+        self.assertEqual(message.deleted_at, deleted_at)
+        await communicator.disconnect()
+
+    async def test_someone_elses_message_is_not_deleted(self):
+        message = await Message.objects.acreate(
+            room=self.room, sender=self.bob, receiver=self.alice, message='mine',
+        )
+        communicator = chat_communicator(self.alice, self.bob.id)
+        await communicator.connect()
+
+        await communicator.send_json_to({'type': 'delete_message', 'message_id': message.id})
+
+        self.assertTrue(await communicator.receive_nothing())
+        await message.arefresh_from_db()
+        self.assertIsNone(message.deleted_at)
+        await communicator.disconnect()
+
+
+class ChatConsumerRoomCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        presence._flush_task = None
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+
+    def tearDown(self):
+        presence._dirty_ids.clear()
+
+    async def test_cache_hit_connects_without_queries(self):
+        room = await database_sync_to_async(make_room)(self.alice, self.bob)
+        await cache.aset(ChatRoom.cache_key(room.user_a_id, room.user_b_id), room.id)
+
+        with (
+            mock.patch.object(ChatConsumer, 'check_user_exists') as check,
+            mock.patch.object(ChatConsumer, 'get_room_id') as get_room_id,
+        ):
+            communicator = chat_communicator(self.alice, self.bob.id)
+            connected, _ = await communicator.connect()
+
+        self.assertTrue(connected)
+        check.assert_not_called()
+        get_room_id.assert_not_called()
+        await communicator.disconnect()
+
+    def test_user_deletion_evicts_cached_room(self):
+        room = make_room(self.alice, self.bob)
+        key = ChatRoom.cache_key(room.user_a_id, room.user_b_id)
+        cache.set(key, room.id)
+
+        self.bob.delete()
+
+        self.assertIsNone(cache.get(key))
+
+    async def test_integrity_error_closes_with_4004(self):
+        with mock.patch.object(
+            ChatConsumer, 'get_room_id', new=mock.AsyncMock(side_effect=IntegrityError),
+        ):
+            communicator = chat_communicator(self.alice, self.bob.id)
+            connected, code = await communicator.connect()
+
+        self.assertFalse(connected)
+        self.assertEqual(code, 4004)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ChatRoom backfill migration (0005)
+# ──────────────────────────────────────────────────────────────────────────────
+
+class ChatRoomBackfillMigrationTests(TransactionTestCase):
+
+    migrate_from = [('chat', '0004_message_msg_rx_sx_unread_idx_and_more')]
+    migrate_to = [('chat', '0006_alter_message_room')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        old_apps = executor.loader.project_state(self.migrate_from).apps
+        OldUser = old_apps.get_model('accounts', 'CustomUser')
+        OldMessage = old_apps.get_model('chat', 'Message')
+
+        alice, bob, carol = (
+            OldUser.objects.create(username=name, email=f'{name}@example.com')
+            for name in ('alice', 'bob', 'carol')
+        )
+        self.pairs = {
+            OldMessage.objects.create(sender=sender, receiver=receiver, message='x').id:
+                tuple(sorted((sender.id, receiver.id)))
+            for sender, receiver in (
+                (alice, bob), (bob, alice), (carol, alice), (bob, carol), (carol, bob),
+            )
+        }
+        self.self_message_id = OldMessage.objects.create(
+            sender=alice, receiver=alice, message='note to self',
+        ).id
+
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        self.apps = executor.loader.project_state(self.migrate_to).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_messages_are_linked_to_their_pair_room(self):
+        ChatRoom = self.apps.get_model('chat', 'ChatRoom')
+        Message = self.apps.get_model('chat', 'Message')
+
+        rooms = {
+            room.id: (room.user_a_id, room.user_b_id)
+            for room in ChatRoom.objects.all()
+        }
+        self.assertEqual(sorted(rooms.values()), sorted(set(self.pairs.values())))
+
+        linked = {m.id: rooms[m.room_id] for m in Message.objects.all()}
+        self.assertEqual(linked, self.pairs)
+
+    def test_self_addressed_messages_are_removed(self):
+        Message = self.apps.get_model('chat', 'Message')
+        self.assertFalse(Message.objects.filter(id=self.self_message_id).exists())
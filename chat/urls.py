@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.landing_page, name='landing'),
     path('users/', views.user_list, name='user_list'),
     path('chat/<int:user_id>/', views.chat_with_user, name='chat_with_user'),
+    path('chat/<int:user_id>/history/', views.message_history, name='message_history'),
     path('chat/<int:user_id>/mark-read/', views.mark_messages_read, name='mark_messages_read'),
     path('messages/<int:message_id>/delete/', views.delete_message, name='delete_message'),
     path('chat/<int:user_id>/clear/', views.clear_history, name='clear_history'),
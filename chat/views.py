@@ -1,13 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Count
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.http import Http404, JsonResponse
+from django.utils import dateformat, timezone
 from django.views.decorators.http import require_POST
-from .models import Message
+from .models import SIDEBAR_CACHE_KEY, ChatRoom, Message
+from .presence import apply_presence
 
 User = get_user_model()
 
+HISTORY_PAGE_SIZE = 50   # messages rendered on open / fetched per "load older"
+
+# Columns the contacts sidebar actually renders (plus last_seen, which
+# apply_presence() overwrites); everything else stays out of the SELECT.
+SIDEBAR_USER_FIELDS = (
+    'id', 'username', 'email', 'is_online', 'last_seen', 'profile_picture',
+)
+
+# The full contacts list is cached under SIDEBAR_CACHE_KEY; signals.py drops
+# it whenever a user is saved or deleted. Live online state comes from
+# apply_presence(), so the timeout only bounds how stale the DB-flushed
+# presence columns can get.
+SIDEBAR_CACHE_TTL = 60   # seconds
+
 
 def _annotate_unread(users, current_user):
     """
@@ -17,7 +35,7 @@ def _annotate_unread(users, current_user):
     # Map: sender_id -> unread_count
     counts = dict(
         Message.objects
-        .filter(receiver=current_user, is_read=False)
+        .filter(receiver=current_user, is_read=False, deleted_at__isnull=True)
         .values('sender_id')
         .annotate(n=Count('id'))
         .values_list('sender_id', 'n')
@@ -26,32 +44,136 @@ def _annotate_unread(users, current_user):
         user.unread_count = counts.get(user.id, 0)
     return users
 
+
+def _sidebar_users(current_user):
+    """Every user except `current_user`, loaded with sidebar columns only."""
+    users = cache.get_or_set(
+        SIDEBAR_CACHE_KEY,
+        lambda: list(User.objects.only(*SIDEBAR_USER_FIELDS)),
+        SIDEBAR_CACHE_TTL,
+    )
+    return [user for user in users if user.id != current_user.id]
+
+
+def _room_name(a, b):
+    """Room name for a pair of user IDs, independent of argument order."""
+    return "private_{}_{}".format(*ChatRoom.ordered(a, b))
+
+
+def _require_user(user_id):
+    """404 unless `user_id` exists — a PK probe, no User row is loaded."""
+    if not User.objects.filter(pk=user_id).exists():
+        raise Http404('No such user.')
+
+
+def _room_id(user_id, other_user_id):
+    """
+    ID of the ChatRoom shared by two users, or None if they never chatted.
+    Shares the consumer's cache entry, so an open chat usually costs no query.
+    """
+    user_a_id, user_b_id = ChatRoom.ordered(user_id, other_user_id)
+    key = ChatRoom.cache_key(user_a_id, user_b_id)
+    room_id = cache.get(key)
+    if room_id is None:
+        room_id = (
+            ChatRoom.objects
+            .filter(user_a_id=user_a_id, user_b_id=user_b_id)
+            .values_list('id', flat=True)
+            .first()
+        )
+        if room_id is not None:
+            cache.set(key, room_id, ChatRoom.CACHE_TTL)
+    return room_id
+
+
+def _room_messages(user_id, other_user_id):
+    """All messages in the ChatRoom shared by two users (no JOIN)."""
+    room_id = _room_id(user_id, other_user_id)
+    if room_id is None:
+        return Message.objects.none()
+    return Message.objects.filter(room_id=room_id)
+
+
+def _conversation(user_id, other_user_id):
+    """Visible (not soft-deleted) messages exchanged between two users."""
+    return _room_messages(user_id, other_user_id).filter(deleted_at__isnull=True)
+
+
+def _history_page(queryset):
+    """
+    Return (messages, has_more): the newest HISTORY_PAGE_SIZE messages of
+    `queryset` in chronological order, and whether older ones remain.
+    IDs grow with insertion order, so -id is newest-first.
+    """
+    page = list(queryset.order_by('-id')[:HISTORY_PAGE_SIZE + 1])
+    has_more = len(page) > HISTORY_PAGE_SIZE
+    return page[:HISTORY_PAGE_SIZE][::-1], has_more
+
+
 @login_required(login_url='login')
 def chat_with_user(request, user_id):
-    other_user = get_object_or_404(User, id=user_id)
-    users = list(User.objects.exclude(id=request.user.id))
-
-    # Mark all unread messages sent by other_user to this user as read
-    Message.objects.filter(
-        sender=other_user,
-        receiver=request.user,
-        is_read=False
-    ).update(is_read=True)
+    # The header renders the same columns as a sidebar entry
+    other_user = get_object_or_404(User.objects.only(*SIDEBAR_USER_FIELDS), pk=user_id)
+    users = _sidebar_users(request.user)
 
     # Annotate sidebar users with unread counts
-    # (after marking current chat as read, so that user's badge shows 0)
     _annotate_unread(users, request.user)
+    apply_presence(users + [other_user])
+
+    # Mark all unread messages sent by other_user to this user as read.
+    # The counts above already tell us whether there are any, so most page
+    # views skip the UPDATE (and its write lock) entirely; the open chat's
+    # badge is then zeroed to match.
+    for user in users:
+        if user.id == other_user.id and user.unread_count:
+            Message.objects.filter(
+                sender=other_user,
+                receiver=request.user,
+                is_read=False,
+                deleted_at__isnull=True,
+            ).update(is_read=True)
+            user.unread_count = 0
 
-    # Get message history
-    messages = Message.objects.filter(
-        Q(sender=request.user, receiver=other_user) |
-        Q(sender=other_user, receiver=request.user)
-    ).order_by('timestamp')
+    # Only the newest page of history is rendered; older pages are pulled
+    # on demand from message_history().
+    messages, has_more = _history_page(_conversation(request.user.id, other_user.id))
 
     return render(request, 'chat/chat.html', {
         'users': users,
         'other_user': other_user,
         'messages': messages,
+        'has_more_history': has_more,
+    })
+
+
+@login_required(login_url='login')
+def message_history(request, user_id):
+    """
+    AJAX endpoint: the page of messages just before ?before=<message_id>.
+    Returns them oldest-first plus a has_more flag for the "load older"
+    button in the chat window.
+    """
+    _require_user(user_id)
+    try:
+        before = int(request.GET.get('before', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid "before" cursor.'}, status=400)
+
+    messages, has_more = _history_page(
+        _conversation(request.user.id, user_id).filter(id__lt=before)
+    )
+    return JsonResponse({
+        'messages': [
+            {
+                'id': m.id,
+                'message': m.message,
+                'mine': m.sender_id == request.user.id,
+                'is_read': m.is_read,
+                'time': dateformat.format(timezone.localtime(m.timestamp), 'h:i A'),
+            }
+            for m in messages
+        ],
+        'has_more': has_more,
     })
 
 
@@ -64,15 +186,21 @@ def mark_messages_read(request, user_id):
     Returns a JSON list of message IDs that were just marked read,
     so the sender's JS can update the ✓ → ✓✓ icon in real-time via WS.
     """
-    other_user = get_object_or_404(User, id=user_id)
-    updated_ids = list(
-        Message.objects.filter(
-            sender=other_user,
-            receiver=request.user,
-            is_read=False
-        ).values_list('id', flat=True)
-    )
-    Message.objects.filter(id__in=updated_ids).update(is_read=True)
+    _require_user(user_id)
+
+    # One UPDATE ... RETURNING instead of SELECT ids + UPDATE: half the
+    # round-trips, and no window for the rows to change in between.
+    # (RETURNING needs PostgreSQL or SQLite >= 3.35.)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {connection.ops.quote_name(Message._meta.db_table)} '
+            'SET is_read = %s '
+            'WHERE sender_id = %s AND receiver_id = %s '
+            'AND is_read = %s AND deleted_at IS NULL '
+            'RETURNING id',
+            [True, user_id, request.user.id, False],
+        )
+        updated_ids = [row[0] for row in cursor.fetchall()]
     return JsonResponse({'read_ids': updated_ids})
 
 
@@ -80,7 +208,7 @@ def mark_messages_read(request, user_id):
 @require_POST
 def delete_message(request, message_id):
     """
-    AJAX endpoint: permanently delete a single message.
+    AJAX endpoint: soft-delete a single message (sets deleted_at).
 
     Permission rules:
       - User must be authenticated (guaranteed by @login_required).
@@ -90,16 +218,17 @@ def delete_message(request, message_id):
     On success, returns {deleted: true, message_id: <id>} so the JS
     can remove the bubble from both participants' screens via WebSocket.
     """
-    message = get_object_or_404(Message, id=message_id)
+    message = get_object_or_404(Message, id=message_id, deleted_at__isnull=True)
 
     # ── Permission check: only the original sender may delete ──────────────────
-    if message.sender != request.user:
+    if message.sender_id != request.user.id:
         return JsonResponse(
             {'error': 'You do not have permission to delete this message.'},
             status=403
         )
 
-    message.delete()
+    message.deleted_at = timezone.now()
+    message.save(update_fields=['deleted_at'])
     return JsonResponse({'deleted': True, 'message_id': message_id})
 
 
@@ -111,11 +240,8 @@ def clear_history(request, user_id):
     Both directions (sent and received) are removed.
     Only participants of the conversation can clear it.
     """
-    other_user = get_object_or_404(User, id=user_id)
-    Message.objects.filter(
-        Q(sender=request.user, receiver=other_user) |
-        Q(sender=other_user,   receiver=request.user)
-    ).delete()
+    _require_user(user_id)
+    _room_messages(request.user.id, user_id).delete()
     return JsonResponse({'cleared': True})
 
 
@@ -132,16 +258,15 @@ def landing_page(request):
 
 @login_required(login_url='login')
 def user_list(request):
-    users = list(User.objects.exclude(id=request.user.id))
+    users = _sidebar_users(request.user)
     _annotate_unread(users, request.user)
+    apply_presence(users)
     return render(request, 'chat/user_list.html', {'users': users})
 
 
+# Neither start_chat nor room is routed in chat/urls.py; the 1-to-1 chat
+# is served by chat_with_user.
 @login_required(login_url='login')
 def start_chat(request, user_id):
-    other_user = get_object_or_404(User, id=user_id)
-    if request.user.id > other_user.id:
-        room_name = f"private_{other_user.id}_{request.user.id}"
-    else:
-        room_name = f"private_{request.user.id}_{other_user.id}"
-    return redirect('chat:room', room_name=room_name)
+    _require_user(user_id)
+    return redirect('chat:room', room_name=_room_name(request.user.id, user_id))
@@ -79,10 +79,35 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open across requests / WS events instead of
+        # reconnecting each time; health checks drop dead ones on reuse.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# Set REDIS_URL to share the cache (sessions, presence) across workers;
+# otherwise fall back to a per-process in-memory cache for development.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -141,4 +166,9 @@ LOGOUT_REDIRECT_URL = 'login'
 # CSRF and Session Settings to avoid conflicts
 CSRF_COOKIE_NAME = "pied_piper_csrftoken"
 SESSION_COOKIE_NAME = "pied_piper_sessionid"
+
+# Sessions are read through the cache (write-through to the DB), so
+# authenticated HTTP requests and WebSocket handshakes (AuthMiddlewareStack)
+# resolve the session without a django_session SELECT on a cache hit.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 CSRF_TRUSTED_ORIGINS = ['http://127.0.0.1:8000']